@@ -3,17 +3,29 @@ import sys
 import logging
 import asyncio
 import datetime
+import math
 import threading
 import time
 import signal
 import atexit
 import json  # Just once is enough
 import io
+import pickle
 import re
+import weakref
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from collections import deque, OrderedDict
+from types import MappingProxyType
 from typing import Dict, Optional, Set, List, Any
-import pytz
+from zoneinfo import ZoneInfo
+import orjson
+try:
+    import uvloop  # libuv-based event loop; not available on Windows
+except ImportError:
+    uvloop = None
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -25,9 +37,13 @@ from telegram.ext import (
     filters,
     ApplicationBuilder,
     PersistenceInput,
-    PicklePersistence
+    PicklePersistence,
+    AIORateLimiter,
+    BaseUpdateProcessor
 )
-from telegram.error import Conflict
+from telegram.ext._picklepersistence import _BotPickler
+from telegram.error import Conflict, BadRequest
+from telegram.request import HTTPXRequest
 
 # For PDF generation
 from reportlab.lib.pagesizes import A4, A5, A6
@@ -61,8 +77,8 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger('telegram.request').setLevel(logging.WARNING)
 
 # Timezone configurations
-PST_TZ = pytz.timezone('America/Los_Angeles')
-MANILA_TZ = pytz.timezone('Asia/Manila')
+PST_TZ = ZoneInfo('America/Los_Angeles')
+MANILA_TZ = ZoneInfo('Asia/Manila')
 
 # Current date and user information
 CURRENT_DATE = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -74,6 +90,24 @@ PID_FILE = "/tmp/rmt_study_bot.pid"
 # Persistence path
 PERSISTENCE_PATH = "/tmp/rmt_study_bot.pickle"
 
+# Outgoing Telegram API connection pool size
+TELEGRAM_CONNECTION_POOL_SIZE = 16
+
+# Outgoing API calls per second, leaving headroom under Telegram's 30/s cap
+TELEGRAM_MAX_MESSAGES_PER_SECOND = 25
+
+# Maximum number of updates handled at the same time
+TELEGRAM_CONCURRENT_UPDATES = 32
+
+# Upper bound on message ids remembered per user for later cleanup
+MAX_TRACKED_MESSAGES = 128
+
+# Study sessions that were never ended are dropped after this long
+STUDY_SESSION_TTL = datetime.timedelta(hours=24)
+
+# Rendered session report PDFs kept in memory for repeat requests
+MAX_CACHED_SESSION_REPORTS = 64
+
 # Google Drive API Constants
 CREDENTIALS_FILE = "credentials.json"  # Fallback file path if environment variable not available
 SCOPES = ['https://www.googleapis.com/auth/drive']
@@ -99,8 +133,35 @@ shared_state = SharedState()
     CONFIRMING_CANCEL,
 ) = range(7)
 
-# Subject mapping
-SUBJECTS = {
+# Custom goal input: hours, then minutes below 60 (e.g. 01:30)
+GOAL_TIME_PATTERN = re.compile(r'^\d+:[0-5]?\d$')
+
+# Emoji-like runs at either end of a subject name, stripped for PDF reports
+TRAILING_EMOJI_PATTERN = re.compile(r'\s+[^\w\s]+$')
+LEADING_EMOJI_PATTERN = re.compile(r'^[^\w\s]+\s+')
+
+# Callback data patterns, compiled once and shared by every handler that uses them
+START_STUDYING_PATTERN = re.compile(r'^start_studying$')
+OVERALL_PROGRESS_PATTERN = re.compile(r'^overall_progress$')
+TODAY_REPORT_PATTERN = re.compile(r'^today_report$')
+LAST_SESSION_REPORT_PATTERN = re.compile(r'^last_session_report$')
+REPORT_SESSION_PATTERN = re.compile(r'^report_session$')
+REPORT_DAY_PATTERN = re.compile(r'^report_day$')
+REPORT_OVERALL_PATTERN = re.compile(r'^report_overall$')
+GOAL_PATTERN = re.compile(r'^goal_(\d+|custom)$')
+NO_GOAL_PATTERN = re.compile(r'^no_goal$')
+SUBJECT_PATTERN = re.compile(r'^subject_\w+$')
+START_BREAK_PATTERN = re.compile(r'^start_break$')
+END_BREAK_PATTERN = re.compile(r'^end_break$')
+END_SESSION_PATTERN = re.compile(r'^end_session$')
+CANCEL_OPERATION_PATTERN = re.compile(r'^cancel_operation$')
+CONFIRM_CANCEL_PATTERN = re.compile(r'^confirm_cancel$')
+REJECT_CANCEL_PATTERN = re.compile(r'^reject_cancel$')
+CONFIRM_RESET_DATA_PATTERN = re.compile(r'^confirm_reset_data$')
+CANCEL_RESET_DATA_PATTERN = re.compile(r'^cancel_reset_data$')
+
+# Subject mapping (read-only)
+SUBJECTS = MappingProxyType({
     "CC 🧪": "CC",
     "BACTE 🦠": "BACTE",
     "VIRO 👾": "VIRO",
@@ -118,7 +179,99 @@ SUBJECTS = {
     "RECALLS 🤔💭": "RECALLS",
     "ANKI 🎟️": "ANKI",
     "Others🤓": "OTHERS"
-}
+})
+
+# Precomputed (label, callback_data) pairs and reverse lookup for subjects
+SUBJECT_BUTTONS = tuple((name, f'subject_{code}') for name, code in SUBJECTS.items())
+SUBJECT_NAMES_BY_CALLBACK = MappingProxyType({callback_data: name for name, callback_data in SUBJECT_BUTTONS})
+
+# Buttons that appear on several keyboards; PTB objects are frozen, so one instance can be shared
+CANCEL_BUTTON = InlineKeyboardButton("Cancel ⬅️", callback_data='cancel_operation')
+END_SESSION_BUTTON = InlineKeyboardButton("End Session ⏹️", callback_data='end_session')
+
+def build_subject_selection_markup():
+    """Build the subject picker keyboard (three subjects per row plus Cancel)."""
+    buttons = []
+    current_row = []
+    
+    for subject_name, callback_data in SUBJECT_BUTTONS:
+        current_row.append(InlineKeyboardButton(subject_name, callback_data=callback_data))
+        
+        if len(current_row) == 3:
+            buttons.append(current_row)
+            current_row = []
+    
+    if current_row:
+        buttons.append(current_row)
+        
+    buttons.append([CANCEL_BUTTON])
+    
+    return InlineKeyboardMarkup(buttons)
+
+# SUBJECTS never changes at runtime, so the keyboard is built once and reused
+SUBJECT_SELECTION_MARKUP = build_subject_selection_markup()
+
+# Static keyboards shared by every handler that shows them
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Start Studying 📚", callback_data='start_studying')],
+    [InlineKeyboardButton("MY OVERALL PROGRESS 📊", callback_data='overall_progress')],
+    [InlineKeyboardButton("STUDY REPORT TODAY 📋", callback_data='today_report')],
+    [InlineKeyboardButton("LAST SESSION REPORT 📄", callback_data='last_session_report')]
+])
+
+STUDY_CONTROLS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Take a Break ☕", callback_data='start_break'),
+        END_SESSION_BUTTON
+    ],
+    [CANCEL_BUTTON]
+])
+
+BREAK_CONTROLS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("End Break ▶️", callback_data='end_break'),
+        END_SESSION_BUTTON
+    ],
+    [CANCEL_BUTTON]
+])
+
+NEW_SESSION_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]
+])
+
+GOAL_SELECTION_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("1 Hour", callback_data='goal_1'),
+        InlineKeyboardButton("2 Hours", callback_data='goal_2'),
+        InlineKeyboardButton("3 Hours", callback_data='goal_3')
+    ],
+    [
+        InlineKeyboardButton("4 Hours", callback_data='goal_4'),
+        InlineKeyboardButton("5 Hours", callback_data='goal_5'),
+        InlineKeyboardButton("6 Hours", callback_data='goal_6')
+    ],
+    [
+        InlineKeyboardButton("✨ Custom Goal (HH:MM) ✨", callback_data='goal_custom')
+    ],
+    [
+        InlineKeyboardButton("No Goal ❌", callback_data='no_goal'),
+        CANCEL_BUTTON
+    ]
+])
+
+CANCEL_CONFIRM_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Yes ✅", callback_data='confirm_cancel'),
+        InlineKeyboardButton("No ❌", callback_data='reject_cancel')
+    ]
+])
+
+RESET_CONFIRM_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Yes, delete my data ✅", callback_data='confirm_reset_data'),
+        InlineKeyboardButton("No, keep my data ❌", callback_data='cancel_reset_data')
+    ]
+])
 
 # Attempt to create credentials file placeholder if it doesn't exist
 if not os.path.exists(CREDENTIALS_FILE):
@@ -137,6 +290,7 @@ class GoogleDriveDB:
         self.database_folder_id = None
         self.initialized = False
         self.local_backup = {}  # For fallback when Google Drive is unavailable
+        self.file_ids = {}  # Drive file ids by file name, so saves skip the lookup query
             
     def initialize(self):
         """Initialize Google Drive API client with retries."""
@@ -218,8 +372,8 @@ class GoogleDriveDB:
                 return True
                 
         try:
-            # Convert data to JSON string
-            json_data = json.dumps(data, default=self._json_serializer)
+            # Convert data to JSON bytes (orjson encodes datetimes natively)
+            json_data = orjson.dumps(data, default=self._json_serializer)
             
             # Check if file already exists
             file_name = f"user_{user_id}_data.json"
@@ -227,7 +381,7 @@ class GoogleDriveDB:
             
             # Create file media
             media = MediaIoBaseUpload(
-                io.BytesIO(json_data.encode()),
+                io.BytesIO(json_data),
                 mimetype='application/json',
                 resumable=True
             )
@@ -245,11 +399,12 @@ class GoogleDriveDB:
                     'name': file_name,
                     'parents': [self.database_folder_id]
                 }
-                self.drive_service.files().create(
+                created = self.drive_service.files().create(
                     body=file_metadata,
                     media_body=media,
                     fields='id'
                 ).execute()
+                self.file_ids[file_name] = created.get('id')
                 logger.info(f"Created new data file for user {user_id}")
                 
             # Also update local backup
@@ -257,6 +412,8 @@ class GoogleDriveDB:
             return True
         except Exception as e:
             logger.error(f"Error saving user data to Drive: {e}")
+            # The cached file id may be stale (e.g. file removed on Drive)
+            self.file_ids.pop(f"user_{user_id}_data.json", None)
             # Store in local backup
             self.local_backup[user_id] = data
             logger.warning(f"Saved data for user {user_id} to local backup only")
@@ -285,11 +442,8 @@ class GoogleDriveDB:
             # Get file content
             file_content = self.drive_service.files().get_media(fileId=file_id).execute()
             
-            # Parse JSON
-            if isinstance(file_content, bytes):
-                data = json.loads(file_content.decode())
-            else:
-                data = json.loads(file_content)
+            # Parse JSON (orjson accepts both bytes and str)
+            data = orjson.loads(file_content)
                 
             logger.info(f"Loaded data for user {user_id} from Google Drive")
             
@@ -302,12 +456,16 @@ class GoogleDriveDB:
             
     def _get_file_id(self, file_name):
         """Get file ID by name."""
+        if file_name in self.file_ids:
+            return self.file_ids[file_name]
+            
         query = f"name='{file_name}' and '{self.database_folder_id}' in parents and trashed=false"
         results = self.drive_service.files().list(
             q=query, spaces='drive', fields='files(id, name)').execute()
         files = results.get('files', [])
         
         if files:
+            self.file_ids[file_name] = files[0]['id']
             return files[0]['id']
         return None
         
@@ -426,13 +584,26 @@ class GoogleDriveDB:
         logger.info(f"Found {len(date_sessions)} sessions for date {date}")
         return date_sessions
     
+# ================== DURATION FORMATTING ==================
+@functools.lru_cache(maxsize=1024)
+def _format_whole_seconds(seconds: int) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    return f"{hours}h {remainder // 60}m"
+
+def format_duration(seconds) -> str:
+    """Format seconds as 'Xh Ym', memoized on whole seconds."""
+    return _format_whole_seconds(int(seconds))
+
 # ================== PDF REPORT GENERATOR ==================
+# Plural weekday names indexed by date.weekday(), used in report insights
+WEEKDAY_NAMES = ("Mondays", "Tuesdays", "Wednesdays", "Thursdays", "Fridays", "Saturdays", "Sundays")
+
 class PDFReportGenerator:
     def __init__(self):
         self.styles = getSampleStyleSheet()
         
-        # Define pastel color palette - updated with pastel pink for date header
-        self.pastel_colors = {
+        # Define pastel color palette - updated with pastel pink for date header (read-only)
+        self.pastel_colors = MappingProxyType({
             'primary': colors.Color(0.6, 0.8, 0.9),        # Pastel blue
             'secondary': colors.Color(0.9, 0.7, 0.8),      # Pastel pink (updated from orange)
             'accent1': colors.Color(0.8, 0.9, 0.8),        # Pastel green
@@ -444,7 +615,7 @@ class PDFReportGenerator:
             'contrast': colors.Color(0.95, 0.95, 0.95),    # Light gray
             'chart1': colors.Color(0.7, 0.8, 0.9),         # Light blue
             'chart2': colors.Color(0.9, 0.7, 0.7)          # Light pink
-        }
+        })
         
         # Create custom styles with professional appearance and UNIQUE names
         self.styles.add(ParagraphStyle(
@@ -538,18 +709,15 @@ class PDFReportGenerator:
     def _remove_emojis(self, subject):
         """Remove emojis from subject names."""
         # Remove anything that looks like an emoji (characters between spaces and non-alphanumeric)
-        import re
         # Find emoji-like patterns (non-alphanumeric characters at the end)
-        clean_subject = re.sub(r'\s+[^\w\s]+$', '', subject)
+        clean_subject = TRAILING_EMOJI_PATTERN.sub('', subject)
         # Also clean any at the beginning
-        clean_subject = re.sub(r'^[^\w\s]+\s+', '', clean_subject)
+        clean_subject = LEADING_EMOJI_PATTERN.sub('', clean_subject)
         return clean_subject.strip()
         
     def _format_time(self, seconds):
         """Format seconds into hours and minutes."""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        return f"{hours}h {minutes}m"
+        return format_duration(seconds)
         
     def _rgb_to_hex(self, rgb_color):
         """Convert RGB color object to hex string for HTML."""
@@ -622,8 +790,7 @@ class PDFReportGenerator:
             best_day_idx = max(day_of_week_times.items(), key=lambda x: x[1] if day_of_week_counts[x[0]] > 0 else 0)[0]
             best_day_avg = day_of_week_times[best_day_idx] / max(1, day_of_week_counts[best_day_idx])
             
-            days = ["Mondays", "Tuesdays", "Wednesdays", "Thursdays", "Fridays", "Saturdays", "Sundays"]
-            insights.append(f"Your most productive day appears to be {days[best_day_idx]}, with an average study time of {self._format_time(best_day_avg)}. Consider using this insight when planning your most challenging study topics.")
+            insights.append(f"Your most productive day appears to be {WEEKDAY_NAMES[best_day_idx]}, with an average study time of {self._format_time(best_day_avg)}. Consider using this insight when planning your most challenging study topics.")
         
         # Progress over time
         if total_days >= 7:
@@ -711,8 +878,8 @@ class PDFReportGenerator:
             for i, break_period in enumerate(session['break_periods']):
                 break_start = break_period['start'].astimezone(MANILA_TZ).strftime('%I:%M %p')
                 break_end = break_period['end'].astimezone(MANILA_TZ).strftime('%I:%M %p')
-                duration = (break_period['end'] - break_period['start']).total_seconds()
-                duration_str = f"{int(duration // 60)}m {int(duration % 60)}s"
+                minutes, seconds = divmod(int((break_period['end'] - break_period['start']).total_seconds()), 60)
+                duration_str = f"{minutes}m {seconds}s"
                 
                 break_data.append([f"{i+1}", break_start, break_end, duration_str])
             
@@ -796,13 +963,16 @@ class PDFReportGenerator:
             no_data = Paragraph("No study sessions recorded for this date.", self.styles['RMT_BodyText'])
             story.append(no_data)
         else:
-            # Clean subject names by removing emojis
+            # Single pass: clean subject names (remove emojis), total study/break
+            # time, and group study time by subject
+            sessions_by_subject = {}
+            total_study_time = 0
+            total_break_time = 0
             for session in sessions:
-                session['subject'] = self._remove_emojis(session['subject'])
-                
-            # Summary statistics
-            total_study_time = sum(session['total_study_time'] for session in sessions)
-            total_break_time = sum(session['total_break_time'] for session in sessions)
+                subject = session['subject'] = self._remove_emojis(session['subject'])
+                sessions_by_subject[subject] = sessions_by_subject.get(subject, 0) + session['total_study_time']
+                total_study_time += session['total_study_time']
+                total_break_time += session['total_break_time']
             
             stats_title = Paragraph("Summary Statistics", self.styles['RMT_SectionHeader'])
             story.append(stats_title)
@@ -819,12 +989,7 @@ class PDFReportGenerator:
                 study_minutes = int(total_study_time / 60)
                 break_minutes = int(total_break_time / 60)
                 
-                def gcd(a, b):
-                    while b:
-                        a, b = b, a % b
-                    return a
-                
-                divisor = gcd(study_minutes, break_minutes)
+                divisor = math.gcd(study_minutes, break_minutes)
                 if divisor > 0:
                     ratio = f"{study_minutes//divisor}:{break_minutes//divisor}"
             
@@ -888,14 +1053,6 @@ class PDFReportGenerator:
             subject_title = Paragraph("Subject Breakdown", self.styles['RMT_SectionHeader'])
             story.append(subject_title)
             
-            # Group sessions by subject
-            sessions_by_subject = {}
-            for session in sessions:
-                subject = session['subject']
-                if subject not in sessions_by_subject:
-                    sessions_by_subject[subject] = 0
-                sessions_by_subject[subject] += session['total_study_time']
-            
             if sessions_by_subject:
                 subject_data = [['Subject', 'Time', 'Percentage']]
                 
@@ -943,10 +1100,7 @@ class PDFReportGenerator:
                     self._format_time(session['total_break_time'])
                 ])
             
-            # UPDATED: Add total row with proper styling
-            total_study_time = sum(session['total_study_time'] for session in sessions)
-            total_break_time = sum(session['total_break_time'] for session in sessions)
-            
+            # UPDATED: Add total row with proper styling (totals from the summary pass)
             session_data.append([
                 'Total',
                 '',
@@ -1025,24 +1179,23 @@ class PDFReportGenerator:
             buffer.seek(0)
             return buffer
         
-        # Clean subject names by removing emojis
-        for session in sessions:
-            session['subject'] = self._remove_emojis(session['subject'])
-        
         # Sort sessions by date
         sessions.sort(key=lambda x: x['start_time'])
         
-        # Group sessions by date
+        # Single pass: clean subject names (remove emojis), group sessions by date,
+        # and total study time per subject and overall
         sessions_by_date = {}
+        subject_times = {}
+        total_study_time = 0
+        total_break_time = 0
         for session in sessions:
-            date_key = session['start_time'].date()
-            if date_key not in sessions_by_date:
-                sessions_by_date[date_key] = []
-            sessions_by_date[date_key].append(session)
+            subject = session['subject'] = self._remove_emojis(session['subject'])
+            sessions_by_date.setdefault(session['start_time'].date(), []).append(session)
+            subject_times[subject] = subject_times.get(subject, 0) + session['total_study_time']
+            total_study_time += session['total_study_time']
+            total_break_time += session['total_break_time']
         
         # Calculate overall statistics
-        total_study_time = sum(session['total_study_time'] for session in sessions)
-        total_break_time = sum(session['total_break_time'] for session in sessions)
         total_days = len(sessions_by_date)
         first_date = min(sessions_by_date.keys())
         last_date = max(sessions_by_date.keys())
@@ -1067,12 +1220,7 @@ class PDFReportGenerator:
             study_minutes = int(total_study_time / 60)
             break_minutes = int(total_break_time / 60)
             
-            def gcd(a, b):
-                while b:
-                    a, b = b, a % b
-                return a
-            
-            divisor = gcd(study_minutes, break_minutes)
+            divisor = math.gcd(study_minutes, break_minutes)
             if divisor > 0:
                 ratio = f"{study_minutes//divisor}:{break_minutes//divisor}"
         
@@ -1099,14 +1247,6 @@ class PDFReportGenerator:
         story.append(insight_title)
         story.append(Spacer(1, 0.2*inch))
         
-        # Calculate subject times for insights
-        subject_times = {}
-        for session in sessions:
-            subject = session['subject']
-            if subject not in subject_times:
-                subject_times[subject] = 0
-            subject_times[subject] += session['total_study_time']
-        
         # Generate AI insights
         insights = self._generate_ai_insights(user_name, sessions, sessions_by_date, 
                                             subject_times, total_study_time, total_break_time)
@@ -1408,14 +1548,6 @@ class PDFReportGenerator:
         subject_title = Paragraph("Subject Breakdown", self.styles['RMT_SectionHeader'])
         story.append(subject_title)
         
-        # Group study time by subject
-        subject_times = {}
-        for session in sessions:
-            subject = session['subject']
-            if subject not in subject_times:
-                subject_times[subject] = 0
-            subject_times[subject] += session['total_study_time']
-        
         # Create table for subject breakdown
         subject_data = [['Subject', 'Total Time', 'Percentage']]
         
@@ -1533,9 +1665,7 @@ class PDFReportGenerator:
             subject_by_date = {}
             for session in subject_sessions:
                 date_key = session['start_time'].date()
-                if date_key not in subject_by_date:
-                    subject_by_date[date_key] = 0
-                subject_by_date[date_key] += session['total_study_time']
+                subject_by_date[date_key] = subject_by_date.get(date_key, 0) + session['total_study_time']
             
             if subject_by_date:
                 daily_subject_title = Paragraph(f"Daily Progress for {subject}", self.styles['RMT_SectionHeader'])
@@ -1583,9 +1713,7 @@ class PDFReportGenerator:
                 subject_sessions_by_date = {}
                 for session in subject_sessions:
                     date_key = session['start_time'].date()
-                    if date_key not in subject_sessions_by_date:
-                        subject_sessions_by_date[date_key] = []
-                    subject_sessions_by_date[date_key].append(session)
+                    subject_sessions_by_date.setdefault(date_key, []).append(session)
                 
                 # Create session tables for each date
                 for date, day_sessions in sorted(subject_sessions_by_date.items(), reverse=True):
@@ -1963,8 +2091,83 @@ class KeepaliveServer:
             self.server.server_close()
             logger.info("Keepalive server stopped")
 
+# ================== TELEGRAM REQUEST CLASS ==================
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Telegram API responses with orjson."""
+    def parse_json_payload(self, payload: bytes) -> Dict[str, Any]:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Let PTB handle malformed or non-UTF-8 payloads the usual way
+            return super().parse_json_payload(payload)
+
+# ================== UPDATE PROCESSOR CLASS ==================
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different users concurrently, but each user's updates in order.
+    
+    ConversationHandler picks a handler from the stored state and only writes the
+    new state after the callback returns, so updates sharing a conversation key
+    (chat, user) must not overlap.
+    """
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.conversation_locks = weakref.WeakValueDictionary()  # Dropped once no update holds or awaits them
+
+    async def process_update(self, update, coroutine):
+        # Queue on the per-user lock before taking a concurrency slot, so one
+        # user's backlog can't occupy every slot and stall everyone else
+        chat = getattr(update, 'effective_chat', None)
+        user = getattr(update, 'effective_user', None)
+        if chat is None and user is None:
+            await super().process_update(update, coroutine)
+            return
+        
+        key = (chat.id if chat else None, user.id if user else None)
+        lock = self.conversation_locks.get(key)
+        if lock is None:
+            lock = self.conversation_locks[key] = asyncio.Lock()
+        
+        async with lock:
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# ================== PERSISTENCE CLASS ==================
+class AtomicPicklePersistence(PicklePersistence):
+    """PicklePersistence that writes through a temp file so a crash mid-save can't corrupt it."""
+    def _dump_file(self, filepath, data):
+        tmp_path = filepath.with_name(filepath.name + '.tmp')
+        super()._dump_file(tmp_path, data)
+        os.replace(tmp_path, filepath)
+
+    def _dump_singlefile(self):
+        # Mirrors PTB's single-file dump, which otherwise rewrites self.filepath in place
+        data = {
+            "conversations": self.conversations,
+            "user_data": self.user_data,
+            "chat_data": self.chat_data,
+            "bot_data": self.bot_data,
+            "callback_data": self.callback_data,
+        }
+        tmp_path = self.filepath.with_name(self.filepath.name + '.tmp')
+        with tmp_path.open("wb") as file:
+            _BotPickler(self.bot, file, protocol=pickle.HIGHEST_PROTOCOL).dump(data)
+        os.replace(tmp_path, self.filepath)
+
 # ================== STUDY SESSION CLASS ==================
 class StudySession:
+    __slots__ = (
+        'user_id', 'subject', 'goal_time', 'start_time', 'end_time',
+        'break_periods', 'break_start', 'is_on_break', 'accumulated_break'
+    )
+
     def __init__(self, user_id: int, subject: str, goal_time: Optional[str] = None):
         self.user_id = user_id
         self.subject = subject
@@ -1974,58 +2177,59 @@ class StudySession:
         self.break_periods = []
         self.break_start = None
         self.is_on_break = False
+        self.accumulated_break = datetime.timedelta()  # Running total of finished breaks
 
-    def start_break(self):
+    def start_break(self, now: Optional[datetime.datetime] = None):
         """Start a break period."""
         if not self.is_on_break:
-            self.break_start = datetime.datetime.now(PST_TZ)
+            self.break_start = now or datetime.datetime.now(PST_TZ)
             self.is_on_break = True
 
-    def end_break(self):
+    def end_break(self, now: Optional[datetime.datetime] = None):
         """End a break period."""
         if self.is_on_break and self.break_start:
-            break_end = datetime.datetime.now(PST_TZ)
+            break_end = now or datetime.datetime.now(PST_TZ)
             self.break_periods.append({
                 'start': self.break_start,
                 'end': break_end
             })
+            self.accumulated_break += break_end - self.break_start
             self.break_start = None
             self.is_on_break = False
 
-    def end(self):
+    def end(self, now: Optional[datetime.datetime] = None):
         """End the study session."""
+        now = now or datetime.datetime.now(PST_TZ)
         if self.is_on_break:
-            self.end_break()
-        self.end_time = datetime.datetime.now(PST_TZ)
+            self.end_break(now)
+        self.end_time = now
 
-    def get_total_study_time(self) -> datetime.timedelta:
+    def get_total_study_time(self, now: Optional[datetime.datetime] = None) -> datetime.timedelta:
         """Calculate total study time excluding breaks."""
         if not self.end_time:
-            current_time = datetime.datetime.now(PST_TZ)
+            current_time = now or datetime.datetime.now(PST_TZ)
         else:
             current_time = self.end_time
 
         total_duration = current_time - self.start_time
-        break_duration = self.get_total_break_time()
+        break_duration = self.get_total_break_time(current_time)
         return total_duration - break_duration
 
-    def get_total_break_time(self) -> datetime.timedelta:
+    def get_total_break_time(self, now: Optional[datetime.datetime] = None) -> datetime.timedelta:
         """Calculate total break time."""
-        total_break = datetime.timedelta()
-        
-        for break_period in self.break_periods:
-            total_break += break_period['end'] - break_period['start']
+        total_break = self.accumulated_break
         
         if self.is_on_break and self.break_start:
-            current_time = datetime.datetime.now(PST_TZ)
+            current_time = now or datetime.datetime.now(PST_TZ)
             total_break += current_time - self.break_start
         
         return total_break
 
     def get_study_break_ratio(self) -> str:
         """Calculate the study to break ratio."""
-        study_time = self.get_total_study_time()
-        break_time = self.get_total_break_time()
+        now = datetime.datetime.now(PST_TZ)
+        study_time = self.get_total_study_time(now)
+        break_time = self.get_total_break_time(now)
         
         study_minutes = int(study_time.total_seconds() / 60)
         break_minutes = int(break_time.total_seconds() / 60)
@@ -2033,12 +2237,7 @@ class StudySession:
         if break_minutes == 0:
             return f"{study_minutes}:0"
         
-        def gcd(a, b):
-            while b:
-                a, b = b, a % b
-            return a
-        
-        divisor = gcd(study_minutes, break_minutes)
+        divisor = math.gcd(study_minutes, break_minutes)
         if divisor == 0:  # Avoid division by zero
             return f"{study_minutes}:{break_minutes}"
         return f"{study_minutes//divisor}:{break_minutes//divisor}"
@@ -2095,6 +2294,8 @@ class StudySession:
 
 # ================== PENDING SESSION CLASS ==================
 class PendingSession:
+    __slots__ = ('user_id', 'chat_id', 'message_ids', 'start_time', 'thread_id')
+
     def __init__(self, user_id: int, chat_id: int, message_ids: list, start_time: datetime.datetime):
         self.user_id = user_id
         self.chat_id = chat_id
@@ -2109,8 +2310,14 @@ class TelegramBot:
         self.pending_sessions: Dict[int, PendingSession] = {}
         self.last_activity = datetime.datetime.now()
         self.start_command_handlers: Set[int] = set()  # Track users who have already triggered /start
+        self.timers: Set[asyncio.Task] = set()  # Strong refs so pending timers aren't GC'd
+        self.session_reports: OrderedDict = OrderedDict()  # LRU of rendered session report bytes
+        self.document_file_ids: OrderedDict = OrderedDict()  # Telegram file_ids of documents already uploaded
         self.application = None
         self.db = GoogleDriveDB()
+        # The Drive client (httplib2) is not thread-safe, so blocking Drive calls
+        # run off the event loop on one dedicated worker thread
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive")
         self.pdf_generator = PDFReportGenerator()
         
         # Initialize Google Drive DB
@@ -2123,27 +2330,18 @@ class TelegramBot:
         user_id = user.id
         
         # Check if the user has data in the database
-        user_data = self.db.load_user_data(user_id)
+        user_data = await self.run_db(self.db.load_user_data, user_id)
         if not user_data:
             await update.message.reply_text("You don't have any stored data to reset.")
             return
         
-        # Create confirmation buttons
-        buttons = [
-            [
-                InlineKeyboardButton("Yes, delete my data ✅", callback_data='confirm_reset_data'),
-                InlineKeyboardButton("No, keep my data ❌", callback_data='cancel_reset_data')
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(buttons)
-        
         # Store the thread_id if the message is in a topic
         if update.message and update.message.is_topic_message:
             context.user_data['thread_id'] = update.message.message_thread_id
         
         await update.message.reply_text(
             "⚠️ WARNING: This will permanently delete all your study session data. Are you sure?",
-            reply_markup=reply_markup
+            reply_markup=RESET_CONFIRM_MARKUP
         )
     
     async def handle_reset_confirmation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2165,7 +2363,7 @@ class TelegramBot:
                 'user_name': update.effective_user.first_name or update.effective_user.username or "User",
                 'sessions': []
             }
-            success = self.db.save_user_data(user_id, empty_data)
+            success = await self.run_db(self.db.save_user_data, user_id, empty_data)
             
             if success:
                 await query.edit_message_text("✅ All your study data has been reset successfully.")
@@ -2174,44 +2372,44 @@ class TelegramBot:
         else:  # cancel_reset_data
             await query.edit_message_text("Operation cancelled. Your data remains unchanged.")
 
+    async def delete_messages(self, bot, chat_id: int, message_ids: list):
+        """Delete several messages concurrently instead of one round trip at a time."""
+        message_ids = list(message_ids)
+        results = await asyncio.gather(
+            *(bot.delete_message(chat_id=chat_id, message_id=message_id) for message_id in message_ids),
+            return_exceptions=True
+        )
+        for message_id, result in zip(message_ids, results):
+            if isinstance(result, Exception):
+                logger.debug(f"Error deleting message {message_id}: {result}")
+
     async def cleanup_all_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Clean up ALL messages including those marked to keep."""
         messages_to_delete = context.user_data.get('messages_to_delete', [])
         messages_to_keep = context.user_data.get('messages_to_keep', [])
         
-        all_messages = messages_to_delete + messages_to_keep
+        all_messages = [*messages_to_delete, *messages_to_keep]
         
-        for message_id in all_messages:
-            try:
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=message_id
-                )
-            except Exception as e:
-                logger.error(f"Error deleting message {message_id}: {e}")
+        # Swap in fresh deques before awaiting, so ids tracked by background
+        # sends during the deletions aren't dropped with the old ones
+        context.user_data['messages_to_delete'] = deque(maxlen=MAX_TRACKED_MESSAGES)
+        context.user_data['messages_to_keep'] = deque(maxlen=MAX_TRACKED_MESSAGES)
         
-        context.user_data['messages_to_delete'] = []
-        context.user_data['messages_to_keep'] = []
+        await self.delete_messages(context.bot, update.effective_chat.id, all_messages)
     
     async def cleanup_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Clean up messages that should be deleted."""
         messages_to_delete = context.user_data.get('messages_to_delete', [])
         
-        for message_id in messages_to_delete:
-            try:
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=message_id
-                )
-            except Exception as e:
-                logger.error(f"Error deleting message {message_id}: {e}")
+        # Swap in a fresh deque before awaiting, so ids tracked by background
+        # sends during the deletions aren't dropped with the old one
+        context.user_data['messages_to_delete'] = deque(maxlen=MAX_TRACKED_MESSAGES)
         
-        context.user_data['messages_to_delete'] = []
+        await self.delete_messages(context.bot, update.effective_chat.id, messages_to_delete)
         
         # Also remove this user from pending sessions if they exist
         user_id = update.effective_user.id
-        if user_id in self.pending_sessions:
-            del self.pending_sessions[user_id]
+        self.pending_sessions.pop(user_id, None)
 
     async def send_bot_message(
         self, 
@@ -2246,8 +2444,9 @@ class TelegramBot:
         elif context and hasattr(context, 'effective_user') and context.effective_user:
             user_id = context.effective_user.id
             
-        if user_id and user_id in self.pending_sessions:
-            pending_thread_id = self.pending_sessions[user_id].thread_id
+        pending_session = self.pending_sessions.get(user_id) if user_id else None
+        if pending_session:
+            pending_thread_id = pending_session.thread_id
             if pending_thread_id:
                 thread_id = pending_thread_id
                 logger.debug(f"Using thread_id {thread_id} from pending session")
@@ -2266,12 +2465,24 @@ class TelegramBot:
         )
         
         if should_delete:
-            if 'messages_to_delete' not in context.user_data:
-                context.user_data['messages_to_delete'] = []
-            context.user_data['messages_to_delete'].append(message.message_id)
+            self.track_message(context, 'messages_to_delete', message.message_id)
             
         return message.message_id
 
+    async def send_no_session_prompt(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+        """Tell the user there is no active session and offer to start one."""
+        await self.send_bot_message(
+            context,
+            chat_id,
+            "No active study session found. Please start a new session."
+        )
+        await self.send_bot_message(
+            context,
+            chat_id,
+            "Start a new session?",
+            reply_markup=NEW_SESSION_MARKUP
+        )
+
     async def send_document(
         self,
         context: ContextTypes.DEFAULT_TYPE,
@@ -2279,9 +2490,10 @@ class TelegramBot:
         document,
         filename: str,
         caption: str = None,
-        should_delete: bool = False
+        should_delete: bool = False,
+        cache_key=None
     ):
-        """Send a document with proper thread ID handling."""
+        """Send a document with proper thread ID handling, reusing a prior upload for the same cache_key."""
         self.record_activity()
         
         # Get thread_id from user_data if available
@@ -2291,22 +2503,108 @@ class TelegramBot:
         elif context.user_data.get('current_thread_id'):
             thread_id = context.user_data['current_thread_id']
         
-        # Send the document with thread_id if in a topic
-        message = await context.bot.send_document(
-            chat_id=chat_id,
-            document=document,
-            filename=filename,
-            caption=caption,
-            message_thread_id=thread_id
-        )
+        # Resend an identical document by file_id instead of uploading it again;
+        # the filename is part of the key because Telegram keeps the original name
+        file_id_key = (cache_key, filename) if cache_key is not None else None
+        file_id = self.document_file_ids.get(file_id_key) if file_id_key else None
+        message = None
+        
+        if file_id:
+            try:
+                message = await context.bot.send_document(
+                    chat_id=chat_id,
+                    document=file_id,
+                    caption=caption,
+                    message_thread_id=thread_id
+                )
+                self.document_file_ids.move_to_end(file_id_key)
+            except BadRequest as e:
+                logger.warning(f"Cached file_id rejected, uploading again: {e}")
+                self.document_file_ids.pop(file_id_key, None)
+        
+        if message is None:
+            # Send the document with thread_id if in a topic
+            message = await context.bot.send_document(
+                chat_id=chat_id,
+                document=document,
+                filename=filename,
+                caption=caption,
+                message_thread_id=thread_id
+            )
+            
+            if file_id_key and message.document:
+                self.document_file_ids[file_id_key] = message.document.file_id
+                while len(self.document_file_ids) > MAX_CACHED_SESSION_REPORTS:
+                    self.document_file_ids.popitem(last=False)
         
         if should_delete:
-            if 'messages_to_delete' not in context.user_data:
-                context.user_data['messages_to_delete'] = []
-            context.user_data['messages_to_delete'].append(message.message_id)
+            self.track_message(context, 'messages_to_delete', message.message_id)
         
         return message.message_id
 
+    def track_message(self, context: ContextTypes.DEFAULT_TYPE, key: str, message_id: int):
+        """Remember a message id in user_data, keeping only the most recent ones."""
+        messages = context.user_data.get(key)
+        if messages is None:
+            messages = context.user_data[key] = deque(maxlen=MAX_TRACKED_MESSAGES)
+        messages.append(message_id)
+
+    async def run_db(self, func, *args):
+        """Run a blocking GoogleDriveDB call on the Drive worker thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_executor, functools.partial(func, *args))
+
+    @staticmethod
+    def session_report_key(user_name: str, session: dict) -> tuple:
+        """Identify a session report by the inputs that determine its content."""
+        return (session.get('user_id'), user_name, session['start_time'], session['end_time'])
+
+    async def render_session_report(self, user_name: str, session: dict) -> bytes:
+        """Render a session report PDF, reusing the bytes if this session was rendered before."""
+        key = self.session_report_key(user_name, session)
+        pdf_bytes = self.session_reports.get(key)
+        
+        if pdf_bytes is None:
+            buffer = await asyncio.to_thread(self.pdf_generator.generate_session_report, user_name, session)
+            pdf_bytes = buffer.getvalue()
+            self.session_reports[key] = pdf_bytes
+            while len(self.session_reports) > MAX_CACHED_SESSION_REPORTS:
+                self.session_reports.popitem(last=False)
+        else:
+            self.session_reports.move_to_end(key)
+        
+        # Hand the bytes straight to send_document; wrapping them in a BytesIO
+        # would make PTB read() a second full copy for the upload
+        return pdf_bytes
+
+    def run_in_background(self, coro) -> asyncio.Task:
+        """Schedule a coroutine without awaiting it; the application drains it on stop."""
+        return self.application.create_task(coro)
+
+    def start_timer(self, coro) -> asyncio.Task:
+        """Schedule a delayed cleanup coroutine, keeping a reference until it finishes.
+        
+        Timers stay out of the application's tasks because Application.stop()
+        waits for those, which would hold shutdown for the whole delay.
+        """
+        task = asyncio.create_task(coro)
+        self.timers.add(task)
+        task.add_done_callback(self.timers.discard)
+        return task
+
+    def prune_stale_sessions(self):
+        """Drop study sessions that were abandoned without being ended."""
+        cutoff = datetime.datetime.now(PST_TZ) - STUDY_SESSION_TTL
+        stale_user_ids = [
+            user_id for user_id, session in self.study_sessions.items()
+            if session.start_time < cutoff
+        ]
+        for user_id in stale_user_ids:
+            self.study_sessions.pop(user_id, None)
+        
+        if stale_user_ids:
+            logger.info(f"Pruned {len(stale_user_ids)} abandoned study sessions")
+
     def record_activity(self):
         """Update last activity timestamp"""
         self.last_activity = datetime.datetime.now()
@@ -2325,7 +2623,7 @@ class TelegramBot:
         self.start_command_handlers.add(user_id)
         
         # Clear the set after a brief delay to allow future /start commands
-        asyncio.create_task(self.clear_start_handler(user_id, 5))  # 5 seconds delay
+        self.start_timer(self.clear_start_handler(user_id, 5))  # 5 seconds delay
         
         await self.cleanup_messages(update, context)
         self.record_activity()
@@ -2364,29 +2662,18 @@ class TelegramBot:
                 del context.user_data['current_thread_id']
             logger.info("No thread ID found, cleared from user data if any")
         
-        # Modified buttons array to include the "LAST SESSION REPORT" button
-        buttons = [
-            [InlineKeyboardButton("Start Studying 📚", callback_data='start_studying')],
-            [InlineKeyboardButton("MY OVERALL PROGRESS 📊", callback_data='overall_progress')],
-            [InlineKeyboardButton("STUDY REPORT TODAY 📋", callback_data='today_report')],
-            [InlineKeyboardButton("LAST SESSION REPORT 📄", callback_data='last_session_report')]
-        ]
-        reply_markup = InlineKeyboardMarkup(buttons)
-        
         welcome_text = "Welcome to RMT Study Bot! 📚✨"
         
         message = await self.send_bot_message(
             context,
             update.effective_chat.id,
             welcome_text,
-            reply_markup=reply_markup,
+            reply_markup=MAIN_MENU_MARKUP,
             should_delete=False
         )
         
         # Store this message to keep it
-        if 'messages_to_keep' not in context.user_data:
-            context.user_data['messages_to_keep'] = []
-        context.user_data['messages_to_keep'].append(message)
+        self.track_message(context, 'messages_to_keep', message)
         
         # Add this user to pending sessions
         user_id = update.effective_user.id
@@ -2406,15 +2693,14 @@ class TelegramBot:
             logger.info(f"Thread ID {thread_id} saved to pending session")
         
         # Schedule cleanup task for this pending session
-        asyncio.create_task(self.schedule_pending_session_cleanup(user_id))
+        self.start_timer(self.schedule_pending_session_cleanup(user_id))
         
         return CHOOSING_MAIN_MENU
 
     async def clear_start_handler(self, user_id: int, delay: int):
         """Clear a user from the start handler set after a delay."""
         await asyncio.sleep(delay)
-        if user_id in self.start_command_handlers:
-            self.start_command_handlers.remove(user_id)
+        self.start_command_handlers.discard(user_id)
 
     async def schedule_pending_session_cleanup(self, user_id: int):
         """Schedule cleanup of a pending session after 30 minutes."""
@@ -2422,21 +2708,18 @@ class TelegramBot:
             await asyncio.sleep(30 * 60)  # 30 minutes
             
             # Check if this pending session still exists and hasn't been completed
-            if user_id in self.pending_sessions and self.application:
-                pending_session = self.pending_sessions[user_id]
+            pending_session = self.pending_sessions.get(user_id)
+            if pending_session and self.application:
                 
                 # Silently delete all associated messages
-                for message_id in pending_session.message_ids:
-                    try:
-                        await self.application.bot.delete_message(
-                            chat_id=pending_session.chat_id,
-                            message_id=message_id
-                        )
-                    except Exception as e:
-                        logger.error(f"Error deleting pending session message {message_id}: {e}")
+                await self.delete_messages(
+                    self.application.bot,
+                    pending_session.chat_id,
+                    pending_session.message_ids
+                )
                 
                 # Remove the pending session silently - no notification sent
-                del self.pending_sessions[user_id]
+                self.pending_sessions.pop(user_id, None)
                 logger.info(f"Silently cleaned up pending session for user {user_id} after timeout")
         
         except Exception as e:
@@ -2447,47 +2730,27 @@ class TelegramBot:
         self.record_activity()
         context.user_data['previous_state'] = CHOOSING_MAIN_MENU
         query = update.callback_query
-        await query.answer()
         
         # Check if we're in a topic/thread
         if update.callback_query.message and update.callback_query.message.is_topic_message:
             # Update the thread_id in user_data
             context.user_data['thread_id'] = update.callback_query.message.message_thread_id
-            
-        await self.cleanup_messages(update, context)
-
-        buttons = [
-            [
-                InlineKeyboardButton("1 Hour", callback_data='goal_1'),
-                InlineKeyboardButton("2 Hours", callback_data='goal_2'),
-                InlineKeyboardButton("3 Hours", callback_data='goal_3')
-            ],
-            [
-                InlineKeyboardButton("4 Hours", callback_data='goal_4'),
-                InlineKeyboardButton("5 Hours", callback_data='goal_5'),
-                InlineKeyboardButton("6 Hours", callback_data='goal_6')
-            ],
-            [
-                InlineKeyboardButton("✨ Custom Goal (HH:MM) ✨", callback_data='goal_custom')
-            ],
-            [
-                InlineKeyboardButton("No Goal ❌", callback_data='no_goal'),
-                InlineKeyboardButton("Cancel ⬅️", callback_data='cancel_operation')
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(buttons)
+        
+        # Acknowledge the button and clear old messages in parallel
+        await asyncio.gather(query.answer(), self.cleanup_messages(update, context))
         
         message_id = await self.send_bot_message(
             context,
             update.effective_chat.id,
             "How long would you like to study? 🎯\nChoose a goal or set a custom duration (HH:MM):",
-            reply_markup=reply_markup
+            reply_markup=GOAL_SELECTION_MARKUP
         )
         
         # Update pending session for this user
         user_id = update.effective_user.id
-        if user_id in self.pending_sessions:
-            self.pending_sessions[user_id].message_ids.append(message_id)
+        pending_session = self.pending_sessions.get(user_id)
+        if pending_session:
+            pending_session.message_ids.append(message_id)
         
         try:
             await query.message.delete()
@@ -2521,12 +2784,13 @@ class TelegramBot:
             
             # Update pending session for this user
             user_id = update.effective_user.id
-            if user_id in self.pending_sessions:
-                self.pending_sessions[user_id].message_ids.append(message_id)
+            pending_session = self.pending_sessions.get(user_id)
+            if pending_session:
+                pending_session.message_ids.append(message_id)
                 
             return SETTING_CUSTOM_GOAL
         
-        goal_time = query.data.split('_')[1] if query.data != 'no_goal' else None
+        goal_time = query.data[len('goal_'):] if query.data != 'no_goal' else None
         context.user_data['goal_time'] = goal_time
         
         return await self.show_subject_selection(update, context)
@@ -2536,9 +2800,7 @@ class TelegramBot:
         self.record_activity()
         try:
             goal_input = update.message.text.strip()
-            hours, minutes = map(int, goal_input.split(':'))
-            
-            if hours < 0 or minutes < 0 or minutes >= 60:
+            if not GOAL_TIME_PATTERN.match(goal_input):
                 raise ValueError
                 
             context.user_data['goal_time'] = goal_input
@@ -2563,8 +2825,9 @@ class TelegramBot:
             
             # Update pending session for this user
             user_id = update.effective_user.id
-            if user_id in self.pending_sessions:
-                self.pending_sessions[user_id].message_ids.append(message_id)
+            pending_session = self.pending_sessions.get(user_id)
+            if pending_session:
+                pending_session.message_ids.append(message_id)
                 
             return SETTING_CUSTOM_GOAL
 
@@ -2572,38 +2835,20 @@ class TelegramBot:
         """Show subject selection buttons."""
         self.record_activity()
         context.user_data['previous_state'] = SETTING_GOAL
-        buttons = []
-        current_row = []
-        
-        for subject_name, subject_code in SUBJECTS.items():
-            current_row.append(InlineKeyboardButton(
-                subject_name, 
-                callback_data=f'subject_{subject_code}'
-            ))
-            
-            if len(current_row) == 3:
-                buttons.append(current_row)
-                current_row = []
-        
-        if current_row:
-            buttons.append(current_row)
-            
-        buttons.append([InlineKeyboardButton("Cancel ⬅️", callback_data='cancel_operation')])
-        
-        reply_markup = InlineKeyboardMarkup(buttons)
         
         message_id = await self.send_bot_message(
             context,
             update.effective_chat.id,
             "Choose your subject: 📚",
-            reply_markup=reply_markup,
+            reply_markup=SUBJECT_SELECTION_MARKUP,
             should_delete=True
         )
         
         # Update pending session for this user
         user_id = update.effective_user.id
-        if user_id in self.pending_sessions:
-            self.pending_sessions[user_id].message_ids.append(message_id)
+        pending_session = self.pending_sessions.get(user_id)
+        if pending_session:
+            pending_session.message_ids.append(message_id)
         
         return CHOOSING_SUBJECT
 
@@ -2624,8 +2869,7 @@ class TelegramBot:
             logger.error(f"Error deleting message: {e}")
 
         user = update.effective_user
-        subject_code = query.data.split('_')[1]
-        subject_name = next((name for name, code in SUBJECTS.items() if code == subject_code), subject_code)
+        subject_name = SUBJECT_NAMES_BY_CALLBACK.get(query.data, query.data[len('subject_'):])
         
         self.study_sessions[user.id] = StudySession(
             user_id=user.id,
@@ -2665,26 +2909,16 @@ class TelegramBot:
                 should_delete=True
             )
 
-        buttons = [
-            [
-                InlineKeyboardButton("Take a Break ☕", callback_data='start_break'),
-                InlineKeyboardButton("End Session ⏹️", callback_data='end_session')
-            ],
-            [InlineKeyboardButton("Cancel ⬅️", callback_data='cancel_operation')]
-        ]
-        reply_markup = InlineKeyboardMarkup(buttons)
-
         await self.send_bot_message(
             context,
             update.effective_chat.id,
             "Session Controls:",
-            reply_markup=reply_markup,
+            reply_markup=STUDY_CONTROLS_MARKUP,
             should_delete=True
         )
         
         # Remove this user from pending sessions as they've completed setup
-        if user.id in self.pending_sessions:
-            del self.pending_sessions[user.id]
+        self.pending_sessions.pop(user.id, None)
         
         return STUDYING
 
@@ -2709,59 +2943,33 @@ class TelegramBot:
         
         if not session:
             # CHANGED: Don't call start() here, just show an error message
-            await self.send_bot_message(
-                context,
-                update.effective_chat.id,
-                "No active study session found. Please start a new session."
-            )
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            await self.send_bot_message(
-                context,
-                update.effective_chat.id,
-                "Start a new session?",
-                reply_markup=reply_markup
-            )
+            await self.send_no_session_prompt(context, update.effective_chat.id)
             return CHOOSING_MAIN_MENU
     
         if query.data == 'start_break':
-            session.start_break()
-            buttons = [
-                [
-                    InlineKeyboardButton("End Break ▶️", callback_data='end_break'),
-                    InlineKeyboardButton("End Session ⏹️", callback_data='end_session')
-                ],
-                [InlineKeyboardButton("Cancel ⬅️", callback_data='cancel_operation')]
-            ]
-            reply_markup = InlineKeyboardMarkup(buttons)
+            now = datetime.datetime.now(PST_TZ)
+            session.start_break(now)
             
-            break_start_time = datetime.datetime.now(PST_TZ).astimezone(MANILA_TZ)
+            break_start_time = now.astimezone(MANILA_TZ)
             await self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 f"☕ Break started at {break_start_time.strftime('%I:%M %p')}",
-                reply_markup=reply_markup,
+                reply_markup=BREAK_CONTROLS_MARKUP,
                 should_delete=False
             )
             return ON_BREAK
                 
         elif query.data == 'end_break':
-            session.end_break()
-            buttons = [
-                [
-                    InlineKeyboardButton("Take a Break ☕", callback_data='start_break'),
-                    InlineKeyboardButton("End Session ⏹️", callback_data='end_session')
-                ],
-                [InlineKeyboardButton("Cancel ⬅️", callback_data='cancel_operation')]
-            ]
-            reply_markup = InlineKeyboardMarkup(buttons)
+            now = datetime.datetime.now(PST_TZ)
+            session.end_break(now)
             
-            break_end_time = datetime.datetime.now(PST_TZ).astimezone(MANILA_TZ)
+            break_end_time = now.astimezone(MANILA_TZ)
             await self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 f"▶️ Break ended at {break_end_time.strftime('%I:%M %p')}\nBack to studying!",
-                reply_markup=reply_markup,
+                reply_markup=STUDY_CONTROLS_MARKUP,
                 should_delete=False
             )
             return STUDYING
@@ -2783,49 +2991,46 @@ class TelegramBot:
             logger.error(f"Error deleting message: {e}")
     
         user = update.effective_user
+        chat_id = update.effective_chat.id
         session = self.study_sessions.get(user.id)
         
         if not session:
             # CHANGED: Don't call start() here, just show an error message
-            await self.send_bot_message(
-                context,
-                update.effective_chat.id,
-                "No active study session found. Please start a new session."
-            )
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            await self.send_bot_message(
-                context,
-                update.effective_chat.id,
-                "Start a new session?",
-                reply_markup=reply_markup
-            )
+            await self.send_no_session_prompt(context, chat_id)
             return CHOOSING_MAIN_MENU
     
         session.end()
         manila_times = session.get_formatted_manila_times()
+        pdf_task = None
         
         try:
             user_name = user.first_name or user.username or "User"
+            
+            # Store the session dictionary for PDF generation and start rendering
+            # the report in a worker thread so it overlaps the summary messages
+            session_dict = session.to_dict()
+            context.user_data['last_session'] = session_dict
+            pdf_task = context.application.create_task(
+                self.render_session_report(user_name, session_dict), update=update
+            )
+            
             summary_msg = await self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 f"🚧 {user_name} ended the session 🚧",
                 should_delete=False
             )
             
-            if 'messages_to_keep' not in context.user_data:
-                context.user_data['messages_to_keep'] = []
-            context.user_data['messages_to_keep'].append(summary_msg)
+            self.track_message(context, 'messages_to_keep', summary_msg)
     
             study_time = session.get_total_study_time()
             study_time_msg = await self.send_bot_message(
                 context,
-                update.effective_chat.id,
-                f"Total Study Time: {int(study_time.total_seconds() // 3600)}h {int((study_time.total_seconds() % 3600) // 60)}m",
+                chat_id,
+                f"Total Study Time: {format_duration(study_time.total_seconds())}",
                 should_delete=False
             )
-            context.user_data['messages_to_keep'].append(study_time_msg)
+            self.track_message(context, 'messages_to_keep', study_time_msg)
     
             session_info = [
                 f"Started: {manila_times['start'].strftime('%I:%M %p')}",
@@ -2848,84 +3053,81 @@ class TelegramBot:
             
             await self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 "\n".join(session_info),
                 should_delete=True
             )
     
             celebration_msg = await self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 f"🎉",
                 should_delete=False
             )
-            context.user_data['messages_to_keep'].append(celebration_msg)
+            self.track_message(context, 'messages_to_keep', celebration_msg)
     
             await self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 f"꧁RMT KA NA SA AUGUST꧂",
                 should_delete=True
             )
     
             # Save completed session to database
-            user_name = user.first_name or user.username or "User"
-            self.db.save_study_session(user.id, user_name, session)
-            
-            # Store the session dictionary for PDF generation
-            session_dict = session.to_dict()
-            context.user_data['last_session'] = session_dict
+            await self.run_db(self.db.save_study_session, user.id, user_name, session)
             
             # CHANGED: Automatically generate and send the PDF without asking
             await self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 "Generating your session report... Please wait...",
                 should_delete=True
             )
             
             try:
-                # Generate PDF
-                pdf_buffer = self.pdf_generator.generate_session_report(user_name, session_dict)
+                # Wait for the PDF started above
+                pdf_buffer = await pdf_task
                 
                 # Send the PDF file with updated naming convention
                 await self.send_document(
                     context,
-                    update.effective_chat.id,
+                    chat_id,
                     pdf_buffer,
                     filename=f"{user_name}, RMT (LAST SESSION Report).pdf",
-                    caption=f"Here's your last study session report, {user_name}!"
+                    caption=f"Here's your last study session report, {user_name}!",
+                    cache_key=self.session_report_key(user_name, session_dict)
                 )
 
             except Exception as e:
                 logger.error(f"Error generating session report: {e}")
                 await self.send_bot_message(
                     context,
-                    update.effective_chat.id,
+                    chat_id,
                     "Sorry, there was an error generating your session report.",
                     should_delete=True
                 )
             
             # Show button to start a new session
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
-            await self.send_bot_message(
+            self.run_in_background(self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 "Ready to start another study session?",
-                reply_markup=reply_markup
-            )
+                reply_markup=NEW_SESSION_MARKUP
+            ))
     
         except Exception as e:
             logger.error(f"Error in end_session: {e}")
+            if pdf_task is not None:
+                # Don't leave the report render orphaned with an unretrieved result
+                pdf_task.cancel()
+                await asyncio.gather(pdf_task, return_exceptions=True)
             await self.send_bot_message(
                 context,
-                update.effective_chat.id,
+                chat_id,
                 "There was an error ending your session. Please try again."
             )
     
-        del self.study_sessions[user.id]
+        self.study_sessions.pop(user.id, None)
         return CHOOSING_MAIN_MENU
 
     async def generate_session_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2968,7 +3170,7 @@ class TelegramBot:
         
         try:
             # Generate PDF
-            pdf_buffer = self.pdf_generator.generate_session_report(user_name, last_session)
+            pdf_buffer = await self.render_session_report(user_name, last_session)
             
             # Send the PDF file
             await self.send_document(
@@ -2976,20 +3178,18 @@ class TelegramBot:
                 update.effective_chat.id,
                 pdf_buffer,
                 filename=f"Session Report - {user_name}, RMT.pdf",
-                caption=f"Here's your session report, {user_name}!"
+                caption=f"Here's your session report, {user_name}!",
+                cache_key=self.session_report_key(user_name, last_session)
             )
             
             # Delete the PDF generation message
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
-            await self.send_bot_message(
+            self.run_in_background(self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 "Ready to start another study session?",
-                reply_markup=reply_markup,
+                reply_markup=NEW_SESSION_MARKUP,
                 should_delete=True
-            )
+            ))
             
         except Exception as e:
             logger.error(f"Error generating session report: {e}")
@@ -3033,7 +3233,7 @@ class TelegramBot:
         
         try:
             # Get today's sessions
-            today_sessions = self.db.get_sessions_for_date(user.id, today)
+            today_sessions = await self.run_db(self.db.get_sessions_for_date, user.id, today)
             
             if not today_sessions:
                 await self.send_bot_message(
@@ -3045,7 +3245,7 @@ class TelegramBot:
                 return CHOOSING_MAIN_MENU
             
             # Generate PDF
-            pdf_buffer = self.pdf_generator.generate_daily_report(user_name, today, today_sessions)
+            pdf_buffer = await asyncio.to_thread(self.pdf_generator.generate_daily_report, user_name, today, today_sessions)
             
             # Send the PDF file
             await self.send_document(
@@ -3058,16 +3258,13 @@ class TelegramBot:
 
             
             # Delete the PDF generation message
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
-            await self.send_bot_message(
+            self.run_in_background(self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 "Ready to start another study session?",
-                reply_markup=reply_markup,
+                reply_markup=NEW_SESSION_MARKUP,
                 should_delete=True
-            )
+            ))
             
         except Exception as e:
             logger.error(f"Error generating day report: {e}")
@@ -3113,7 +3310,7 @@ class TelegramBot:
         
         try:
             # Get all study sessions for this user
-            all_sessions = self.db.get_user_study_sessions(user.id)
+            all_sessions = await self.run_db(self.db.get_user_study_sessions, user.id)
             
             if not all_sessions:
                 await self.send_bot_message(
@@ -3125,7 +3322,9 @@ class TelegramBot:
                 return CHOOSING_MAIN_MENU
             
             # Generate PDF
-            pdf_buffer = self.pdf_generator.generate_full_report(user_name, all_sessions)
+            # The report sorts its input, so hand the worker thread a copy of the
+            # list the Drive thread may be serializing
+            pdf_buffer = await asyncio.to_thread(self.pdf_generator.generate_full_report, user_name, list(all_sessions))
             
             # Add current date for the filename
             current_date = datetime.datetime.now(MANILA_TZ).strftime('%Y-%m-%d')
@@ -3140,16 +3339,13 @@ class TelegramBot:
             )
             
             # Show start studying button
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
-            await self.send_bot_message(
+            self.run_in_background(self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 "Ready to start another study session?",
-                reply_markup=reply_markup,
+                reply_markup=NEW_SESSION_MARKUP,
                 should_delete=True
-            )
+            ))
             
             return CHOOSING_MAIN_MENU
             
@@ -3200,7 +3396,7 @@ class TelegramBot:
             logger.info(f"Today's date in Manila: {today}")
             
             # Get all sessions for debugging
-            all_sessions = self.db.get_user_study_sessions(user.id)
+            all_sessions = await self.run_db(self.db.get_user_study_sessions, user.id)
             logger.info(f"User has {len(all_sessions)} total sessions")
             
             # Debug: Print all session dates
@@ -3216,7 +3412,7 @@ class TelegramBot:
                     logger.error(f"Error examining session {idx}: {e}")
                     
             # Get study sessions for today
-            today_sessions = self.db.get_sessions_for_date(user.id, today)
+            today_sessions = await self.run_db(self.db.get_sessions_for_date, user.id, today)
             
             logger.info(f"Found {len(today_sessions)} sessions for user {user.id} on {today}")
             
@@ -3230,7 +3426,7 @@ class TelegramBot:
                 return CHOOSING_MAIN_MENU
             
             # Generate PDF
-            pdf_buffer = self.pdf_generator.generate_daily_report(user_name, today, today_sessions)
+            pdf_buffer = await asyncio.to_thread(self.pdf_generator.generate_daily_report, user_name, today, today_sessions)
             
             # Send the PDF file
             await self.send_document(
@@ -3242,16 +3438,13 @@ class TelegramBot:
             )
             
             # Show start studying button
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
-            await self.send_bot_message(
+            self.run_in_background(self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 "Ready to start another study session?",
-                reply_markup=reply_markup,
+                reply_markup=NEW_SESSION_MARKUP,
                 should_delete=True
-            )
+            ))
             
             return CHOOSING_MAIN_MENU
             
@@ -3300,7 +3493,7 @@ class TelegramBot:
         
         try:
             # Get all study sessions for this user
-            all_sessions = self.db.get_user_study_sessions(user.id)
+            all_sessions = await self.run_db(self.db.get_user_study_sessions, user.id)
             
             if not all_sessions:
                 await self.send_bot_message(
@@ -3315,7 +3508,7 @@ class TelegramBot:
             last_session = max(all_sessions, key=lambda s: s['start_time'])
             
             # Generate PDF
-            pdf_buffer = self.pdf_generator.generate_session_report(user_name, last_session)
+            pdf_buffer = await self.render_session_report(user_name, last_session)
             
             # Send the PDF file
             await self.send_document(
@@ -3323,20 +3516,18 @@ class TelegramBot:
                 update.effective_chat.id,
                 pdf_buffer,
                 filename=f"Last Session Report - {user_name}, RMT.pdf",
-                caption=f"Here's your last study session report, {user_name}!"
+                caption=f"Here's your last study session report, {user_name}!",
+                cache_key=self.session_report_key(user_name, last_session)
             )
             
             # Show start studying button
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
-            await self.send_bot_message(
+            self.run_in_background(self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 "Ready to start another study session?",
-                reply_markup=reply_markup,
+                reply_markup=NEW_SESSION_MARKUP,
                 should_delete=True
-            )
+            ))
             
         except Exception as e:
             logger.error(f"Error generating last session report: {e}")
@@ -3367,27 +3558,20 @@ class TelegramBot:
                 await query.message.delete()
             except Exception as e:
                 logger.error(f"Error deleting message: {e}")
-
-        buttons = [
-            [
-                InlineKeyboardButton("Yes ✅", callback_data='confirm_cancel'),
-                InlineKeyboardButton("No ❌", callback_data='reject_cancel')
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(buttons)
         
         message_id = await self.send_bot_message(
             context,
             update.effective_chat.id,
             "Are you sure you want to cancel?",
-            reply_markup=reply_markup,
+            reply_markup=CANCEL_CONFIRM_MARKUP,
             should_delete=True
         )
         
         # Update pending session for this user
         user_id = update.effective_user.id
-        if user_id in self.pending_sessions:
-            self.pending_sessions[user_id].message_ids.append(message_id)
+        pending_session = self.pending_sessions.get(user_id)
+        if pending_session:
+            pending_session.message_ids.append(message_id)
         
         return CONFIRMING_CANCEL
 
@@ -3409,25 +3593,20 @@ class TelegramBot:
     
         if query.data == 'confirm_cancel':
             user = update.effective_user
-            if user.id in self.study_sessions:
-                del self.study_sessions[user.id]
+            self.study_sessions.pop(user.id, None)
             
             # Also remove from pending sessions
-            if user.id in self.pending_sessions:
-                del self.pending_sessions[user.id]
+            self.pending_sessions.pop(user.id, None)
             
             await self.cleanup_messages(update, context)
             
             # CHANGED: Don't call start() which creates a new conversation
             # Instead, just show options to start a new session
-            buttons = [[InlineKeyboardButton("Start New Study Session 📚", callback_data='start_studying')]]
-            reply_markup = InlineKeyboardMarkup(buttons)
-            
             await self.send_bot_message(
                 context,
                 update.effective_chat.id,
                 "Operation cancelled. Would you like to start a new session?",
-                reply_markup=reply_markup,
+                reply_markup=NEW_SESSION_MARKUP,
                 should_delete=True
             )
             return CHOOSING_MAIN_MENU
@@ -3496,7 +3675,8 @@ async def run_bot_with_retries():
         if shared_state.is_shutting_down:
             logger.info("Shutdown signal received. Exiting...")
             break
-            
+        
+        telegram_bot = None
         try:
             # Create application with proper token
             token = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -3517,7 +3697,7 @@ async def run_bot_with_retries():
             
             # Create persistence object to maintain conversation state across restarts
             try:
-                persistence = PicklePersistence(
+                persistence = AtomicPicklePersistence(
                     filepath=PERSISTENCE_PATH,
                     store_data=PersistenceInput(
                         chat_data=True,
@@ -3534,6 +3714,30 @@ async def run_bot_with_retries():
                 
             # Set up proper drop_pending_updates to avoid handling old messages
             builder = ApplicationBuilder().token(token)
+            
+            # Reuse pooled HTTP/2 connections for all outgoing API calls instead of
+            # queueing them on PTB's default single-connection pool
+            builder = builder.request(OrjsonHTTPXRequest(
+                connection_pool_size=TELEGRAM_CONNECTION_POOL_SIZE,
+                pool_timeout=5.0,
+                http_version='2'
+            ))
+            builder = builder.get_updates_request(OrjsonHTTPXRequest(connection_pool_size=1))
+            
+            # Process updates from different users in parallel instead of one by one,
+            # while each user's updates still run in order for the ConversationHandler
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(TELEGRAM_CONCURRENT_UPDATES))
+            
+            # Pace outgoing calls below Telegram's ~30 msg/s bot-wide limit so bursts
+            # are queued locally instead of triggering 429 RetryAfter back-offs.
+            # The per-group limiter is disabled: PTB would apply its 20/min cap to
+            # every group call, deletions included, stalling study topics for up to
+            # a minute, while Telegram's group limit only covers sent messages
+            builder = builder.rate_limiter(AIORateLimiter(
+                overall_max_rate=TELEGRAM_MAX_MESSAGES_PER_SECOND,
+                overall_time_period=1,
+                group_max_rate=0
+            ))
             if persistence:
                 builder = builder.persistence(persistence)
             
@@ -3552,65 +3756,64 @@ async def run_bot_with_retries():
             application.add_handler(CommandHandler('reset_mydata', telegram_bot.reset_user_data))
             
             # Add reset data confirmation handlers
-            application.add_handler(CallbackQueryHandler(telegram_bot.handle_reset_confirmation, pattern='^confirm_reset_data$'))
-            application.add_handler(CallbackQueryHandler(telegram_bot.handle_reset_confirmation, pattern='^cancel_reset_data$'))
+            application.add_handler(CallbackQueryHandler(telegram_bot.handle_reset_confirmation, pattern=CONFIRM_RESET_DATA_PATTERN))
+            application.add_handler(CallbackQueryHandler(telegram_bot.handle_reset_confirmation, pattern=CANCEL_RESET_DATA_PATTERN))
+            
+            # Handlers are stateless, so each one is built once and shared by every
+            # state, fallback and top-level registration that needs it
+            cancel_operation_handler = CallbackQueryHandler(telegram_bot.cancel_operation, pattern=CANCEL_OPERATION_PATTERN)
+            start_break_handler = CallbackQueryHandler(telegram_bot.handle_break, pattern=START_BREAK_PATTERN)
+            end_break_handler = CallbackQueryHandler(telegram_bot.handle_break, pattern=END_BREAK_PATTERN)
+            end_session_handler = CallbackQueryHandler(telegram_bot.end_session, pattern=END_SESSION_PATTERN)
+            main_menu_handlers = [
+                CallbackQueryHandler(telegram_bot.ask_goal, pattern=START_STUDYING_PATTERN),
+                CallbackQueryHandler(telegram_bot.generate_overall_progress_report, pattern=OVERALL_PROGRESS_PATTERN),
+                CallbackQueryHandler(telegram_bot.generate_today_report, pattern=TODAY_REPORT_PATTERN),
+                CallbackQueryHandler(telegram_bot.generate_session_report, pattern=REPORT_SESSION_PATTERN),
+                CallbackQueryHandler(telegram_bot.generate_day_report, pattern=REPORT_DAY_PATTERN),
+                CallbackQueryHandler(telegram_bot.generate_overall_progress_report, pattern=REPORT_OVERALL_PATTERN),
+                # Add the new handler for last session report
+                CallbackQueryHandler(telegram_bot.get_last_session_report, pattern=LAST_SESSION_REPORT_PATTERN)
+            ]
             
             conv_handler = ConversationHandler(
-                entry_points=[
-                    CallbackQueryHandler(telegram_bot.ask_goal, pattern='^start_studying$'),
-                    CallbackQueryHandler(telegram_bot.generate_overall_progress_report, pattern='^overall_progress$'),
-                    CallbackQueryHandler(telegram_bot.generate_today_report, pattern='^today_report$'),
-                    CallbackQueryHandler(telegram_bot.generate_session_report, pattern='^report_session$'),
-                    CallbackQueryHandler(telegram_bot.generate_day_report, pattern='^report_day$'),
-                    CallbackQueryHandler(telegram_bot.generate_overall_progress_report, pattern='^report_overall$'),
-                    # Add the new handler for last session report
-                    CallbackQueryHandler(telegram_bot.get_last_session_report, pattern='^last_session_report$')
-                ],
+                entry_points=main_menu_handlers,
                 states={
                     CONFIRMING_CANCEL: [
-                        CallbackQueryHandler(telegram_bot.handle_cancel_confirmation, pattern='^confirm_cancel$'),
-                        CallbackQueryHandler(telegram_bot.handle_cancel_confirmation, pattern='^reject_cancel$')
-                    ],
-                    CHOOSING_MAIN_MENU: [
-                        CallbackQueryHandler(telegram_bot.ask_goal, pattern='^start_studying$'),
-                        CallbackQueryHandler(telegram_bot.generate_overall_progress_report, pattern='^overall_progress$'),
-                        CallbackQueryHandler(telegram_bot.generate_today_report, pattern='^today_report$'),
-                        CallbackQueryHandler(telegram_bot.generate_session_report, pattern='^report_session$'),
-                        CallbackQueryHandler(telegram_bot.generate_day_report, pattern='^report_day$'),
-                        CallbackQueryHandler(telegram_bot.generate_overall_progress_report, pattern='^report_overall$'),
-                        # Add the new handler for last session report
-                        CallbackQueryHandler(telegram_bot.get_last_session_report, pattern='^last_session_report$')
+                        CallbackQueryHandler(telegram_bot.handle_cancel_confirmation, pattern=CONFIRM_CANCEL_PATTERN),
+                        CallbackQueryHandler(telegram_bot.handle_cancel_confirmation, pattern=REJECT_CANCEL_PATTERN)
                     ],
+                    CHOOSING_MAIN_MENU: main_menu_handlers,
                     SETTING_GOAL: [
-                        CallbackQueryHandler(telegram_bot.handle_goal_selection, pattern='^goal_'),
-                        CallbackQueryHandler(telegram_bot.handle_goal_selection, pattern='^no_goal$'),
-                        CallbackQueryHandler(telegram_bot.cancel_operation, pattern='^cancel_operation$')
+                        CallbackQueryHandler(telegram_bot.handle_goal_selection, pattern=GOAL_PATTERN),
+                        CallbackQueryHandler(telegram_bot.handle_goal_selection, pattern=NO_GOAL_PATTERN),
+                        cancel_operation_handler
                     ],
                     SETTING_CUSTOM_GOAL: [
                         MessageHandler(filters.TEXT & ~filters.COMMAND, telegram_bot.handle_custom_goal),
-                        CallbackQueryHandler(telegram_bot.cancel_operation, pattern='^cancel_operation$')
+                        cancel_operation_handler
                     ],
                     CHOOSING_SUBJECT: [
-                        CallbackQueryHandler(telegram_bot.start_studying, pattern='^subject_'),
-                        CallbackQueryHandler(telegram_bot.cancel_operation, pattern='^cancel_operation$')
+                        CallbackQueryHandler(telegram_bot.start_studying, pattern=SUBJECT_PATTERN),
+                        cancel_operation_handler
                     ],
                     STUDYING: [
-                        CallbackQueryHandler(telegram_bot.handle_break, pattern='^start_break$'),
-                        CallbackQueryHandler(telegram_bot.end_session, pattern='^end_session$'),
-                        CallbackQueryHandler(telegram_bot.cancel_operation, pattern='^cancel_operation$')
+                        start_break_handler,
+                        end_session_handler,
+                        cancel_operation_handler
                     ],
                     ON_BREAK: [
-                        CallbackQueryHandler(telegram_bot.handle_break, pattern='^end_break$'),
-                        CallbackQueryHandler(telegram_bot.end_session, pattern='^end_session$'),
-                        CallbackQueryHandler(telegram_bot.cancel_operation, pattern='^cancel_operation$')
+                        end_break_handler,
+                        end_session_handler,
+                        cancel_operation_handler
                     ]
                 },
                 fallbacks=[
-                    CallbackQueryHandler(telegram_bot.cancel_operation, pattern='^cancel_operation$'),
+                    cancel_operation_handler,
                     # Add these lines to ensure buttons work even outside state handling
-                    CallbackQueryHandler(telegram_bot.handle_break, pattern='^start_break$'),
-                    CallbackQueryHandler(telegram_bot.handle_break, pattern='^end_break$'), 
-                    CallbackQueryHandler(telegram_bot.end_session, pattern='^end_session$')
+                    start_break_handler,
+                    end_break_handler,
+                    end_session_handler
                 ],
                 per_chat=True,
                 name="main_conversation",
@@ -3619,9 +3822,9 @@ async def run_bot_with_retries():
 
             application.add_handler(conv_handler)
 
-            application.add_handler(CallbackQueryHandler(telegram_bot.handle_break, pattern='^start_break$'))
-            application.add_handler(CallbackQueryHandler(telegram_bot.handle_break, pattern='^end_break$'))
-            application.add_handler(CallbackQueryHandler(telegram_bot.end_session, pattern='^end_session$'))
+            application.add_handler(start_break_handler)
+            application.add_handler(end_break_handler)
+            application.add_handler(end_session_handler)
 
             application.add_error_handler(error_handler)
             
@@ -3630,6 +3833,14 @@ async def run_bot_with_retries():
             
             # Initialize and start the application
             await application.initialize()
+            
+            # Keep active study sessions in bot_data so PicklePersistence saves them
+            # with the conversation state and they survive a restart
+            if persistence:
+                telegram_bot.study_sessions = application.bot_data.setdefault('study_sessions', {})
+                telegram_bot.prune_stale_sessions()
+                logger.info(f"Restored {len(telegram_bot.study_sessions)} active study sessions")
+            
             await application.start()
             
             # Start polling with critical fix: force drop_pending_updates=True
@@ -3661,6 +3872,9 @@ async def run_bot_with_retries():
                         await application.bot.get_me()
                         logger.info("Health check passed despite inactivity")
                         telegram_bot.last_activity = current_time  # Reset activity timer
+                        # This get_me result also covers the periodic check below
+                        last_health_check = current_time
+                        health_check_due = False
                     except Exception as e:
                         logger.error(f"Health check failed after inactivity: {e}")
                         raise RuntimeError("Activity timeout and health check failure")
@@ -3671,6 +3885,7 @@ async def run_bot_with_retries():
                         await application.bot.get_me()
                         logger.debug("Periodic health check passed")
                         last_health_check = current_time
+                        telegram_bot.prune_stale_sessions()
                     except Exception as e:
                         logger.error(f"Periodic health check failed: {e}")
                         raise RuntimeError("Health check failure")
@@ -3705,6 +3920,11 @@ async def run_bot_with_retries():
             else:
                 logger.error("Max retries reached or shutdown requested. Exiting...")
                 break
+        
+        finally:
+            # Each attempt builds a new TelegramBot; release its Drive worker thread
+            if telegram_bot is not None:
+                telegram_bot.db_executor.shutdown(wait=False)
     
     # Stop the keepalive server
     keepalive_server.stop()
@@ -3741,8 +3961,11 @@ def main():
         logger.info(f"Process ID: {os.getpid()}")
         logger.info(f"Google Drive credentials from environment: {'Available' if os.environ.get('GOOGLE_CREDENTIALS') else 'Not available'}")
         
-        # Run the bot with retries
-        asyncio.run(run_bot_with_retries())
+        # Run the bot with retries, on uvloop when it is installed
+        if uvloop:
+            uvloop.run(run_bot_with_retries())
+        else:
+            asyncio.run(run_bot_with_retries())
         
         logger.info("Bot has shutdown gracefully.")
         sys.exit(0)